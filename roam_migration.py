@@ -15,22 +15,53 @@ Version: 1.0.0
 
 import os
 import json
+import functools
+import itertools
+import pickle
 import requests
+from requests.adapters import HTTPAdapter
 import hashlib
 import re
+import mmap
+import mimetypes
 from pathlib import Path
+from types import MappingProxyType
+from collections import defaultdict
+from contextlib import ExitStack
 from datetime import datetime
 import time
 import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from typing import Dict, List, Tuple, Optional
 import sys
 
+try:
+    import boto3
+    from boto3.exceptions import S3UploadFailedError
+    from boto3.s3.transfer import TransferConfig
+    from botocore.config import Config as BotoConfig
+    from botocore.exceptions import BotoCoreError, ClientError
+except ImportError:  # Only needed when uploading through the S3 API
+    boto3 = None
+
+try:
+    import ijson
+except ImportError:  # Optional, streams large Roam JSON files page by page
+    ijson = None
+
+try:
+    import orjson
+except ImportError:  # Optional, faster JSON encoding for the migrated graph
+    orjson = None
+
 # DEFAULT CONFIGURATION
 DEFAULT_CONFIG = {
     'API_TOKEN': '',  # Your Cloudflare API token with R2 permissions
     'ACCOUNT_ID': '',  # Your Cloudflare account ID
     'BUCKET_NAME': '',  # Your R2 bucket name
     'PUBLIC_URL': '',  # Public URL of your R2 bucket
+    'S3_ACCESS_KEY_ID': '',  # Optional R2 S3 API key - enables multipart uploads via boto3
+    'S3_SECRET_ACCESS_KEY': '',  # Secret for the R2 S3 API key
     
     'FILES_FOLDER': '',  # Path to "Files and images" folder from Roam export
     'ROAM_JSON': '',  # Path to the exported Roam JSON file
@@ -39,10 +70,221 @@ DEFAULT_CONFIG = {
     
     'KEEP_ORIGINAL_NAMES': True,  # Keep original filenames for traceability
     'CLEAN_FILENAMES': True,  # Clean problematic characters from filenames
-    'BATCH_SIZE': 50,  # Number of files to process before saving progress
+    'BATCH_SIZE': 50,  # Number of files to process between progress reports
     'MAX_RETRIES': 3,  # Maximum retries for failed uploads
+    'CONCURRENCY': 16,  # Number of uploads running in parallel
+    'MULTIPART_THRESHOLD': 8 * 1024 * 1024,  # Files above this size are uploaded in parts (S3 API only)
+    'MULTIPART_CONCURRENCY': 8,  # Parts uploaded in parallel per file (S3 API only)
+    'MMAP_THRESHOLD': 64 * 1024 * 1024,  # Files above this size are memory-mapped for upload (REST API only)
+    'JSON_WORKERS': os.cpu_count() or 1,  # Processes rewriting JSON pages in parallel (1 = no pool)
+    'JSON_CHUNK_SIZE': 32,  # Pages sent to a JSON worker at a time
 }
 
+# Firebase media links in block strings, one named alternative per media type.
+# Each alternative captures the Firebase URL as "<type>_url".
+MEDIA_LINK_PATTERN = re.compile(
+    r'(?P<image>!\[(?P<alt>[^\]]*)\]\((?P<image_url>https://firebasestorage[^)]+\.enc[^)]*)\))'
+    r'|(?P<pdf>\{\{\[\[pdf\]\]:\s*(?P<pdf_url>https://firebasestorage[^}]+\.enc[^}]*)\}\})'
+    r'|(?P<video>\{\{\[\[video\]\]:\s*(?P<video_url>https://firebasestorage[^}]+\.enc[^}]*)\}\})'
+    r'|(?P<link><(?P<link_url>https://firebasestorage[^>]+\.enc[^>]*)>)',
+    re.IGNORECASE
+)
+
+# Content types for common Roam attachments; anything else goes through mimetypes
+CONTENT_TYPES = MappingProxyType({
+    '.png': 'image/png',
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.gif': 'image/gif',
+    '.webp': 'image/webp',
+    '.svg': 'image/svg+xml',
+    '.pdf': 'application/pdf',
+    '.mp4': 'video/mp4',
+    '.mp3': 'audio/mpeg',
+    '.wav': 'audio/wav',
+    '.doc': 'application/msword',
+    '.docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    '.xls': 'application/vnd.ms-excel',
+    '.xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    '.zip': 'application/zip',
+})
+
+# File ID and extension inside a Firebase storage URL
+FIREBASE_URL_PATTERN = re.compile(r'imgs%2Fapp%2F[^%]+%2F([^.]+)\.([^.]+)\.enc')
+
+def extract_firebase_id(url: str) -> Tuple[Optional[str], Optional[str]]:
+    """Extract file ID and extension from Firebase URL"""
+    match = FIREBASE_URL_PATTERN.search(url)
+    if match:
+        return match.group(1), '.' + match.group(2)
+    return None, None
+
+def split_filename(name: str) -> Tuple[str, str]:
+    """Split a file name into stem and suffix, like Path.stem and Path.suffix"""
+    stem, dot, ext = name.rpartition('.')
+    if not stem or not ext:
+        return name, ''
+    return stem, dot + ext
+
+def short_hash(data: bytes) -> str:
+    """12-character hex ID used for hash-based filenames"""
+    # Kept on MD5 so names match files uploaded by earlier runs
+    return hashlib.md5(data).hexdigest()[:12]
+
+def encode_page(page: Dict) -> bytes:
+    """Encode a page as UTF-8 JSON indented by 2 spaces"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(page, option=orjson.OPT_INDENT_2)
+        except orjson.JSONEncodeError:
+            pass  # Deeper nesting or larger integers than orjson supports
+    return json.dumps(page, ensure_ascii=False, indent=2).encode('utf-8')
+
+@functools.lru_cache(maxsize=4096)
+def numeric_suffix_pattern(firebase_id: str, extension: str):
+    """Pattern for exported files named like <firebase_id>-12345<extension>"""
+    return re.compile(f"^{re.escape(firebase_id)}-\\d+{re.escape(extension)}$", re.IGNORECASE)
+
+class LinkRewriter:
+    """
+    Rewrites Firebase media links in Roam pages to the uploaded public URLs.
+    Holds only plain lookup data, so it can be sent to worker processes.
+    """
+    
+    def __init__(self, public_url: str, entries: List[Dict], mapping: Dict[str, int],
+                 uploaded_files: Dict[str, str], local_files_cache: Dict[str, Path],
+                 files_by_prefix: Dict[str, List[Path]]):
+        self.public_url = public_url
+        self.entries = entries
+        self.mapping = mapping
+        self.uploaded_files = uploaded_files
+        self.local_files_cache = local_files_cache
+        self.files_by_prefix = files_by_prefix
+        
+        # Link counts for the page being rewritten
+        self.links_updated = 0
+        self.links_not_found = 0
+    
+    def find_file_for_firebase_id(self, firebase_id: str, extension: str) -> Optional[Path]:
+        """
+        Find local file that corresponds to a Firebase storage ID.
+        Handles various naming patterns Roam uses during export.
+        """
+        # Direct lookup attempts
+        lookup_keys = [
+            firebase_id,
+            f"{firebase_id}-image",
+            f"{firebase_id}{extension}",
+            f"{firebase_id}-image{extension}",
+        ]
+        
+        for key in lookup_keys:
+            if key in self.local_files_cache:
+                file_path = self.local_files_cache[key]
+                # Verify extension matches
+                if file_path.suffix.lower() == extension.lower():
+                    return file_path
+        
+        # Only files whose stem starts with this ID followed by a dash (or is
+        # the ID itself) can match from here on
+        candidates = self.files_by_prefix.get(firebase_id.lower(), ())
+        
+        # Pattern matching for files with numeric suffixes
+        pattern = numeric_suffix_pattern(firebase_id, extension)
+        for path in candidates:
+            if pattern.match(path.name):
+                return path
+        
+        # Pattern matching for files with additional text
+        for path in candidates:
+            if path.name.startswith(firebase_id) and path.suffix.lower() == extension.lower():
+                return path
+        
+        return None
+    
+    def resolve_media_url(self, firebase_id: str, extension: str) -> Optional[str]:
+        """Find the new public URL for a Firebase storage ID, if the file was uploaded"""
+        # First check direct mapping
+        if firebase_id in self.mapping:
+            return self.entries[self.mapping[firebase_id]]['public_url']
+        
+        # Try to find the file
+        local_file = self.find_file_for_firebase_id(firebase_id, extension)
+        if local_file:
+            # Check if it was uploaded with a different name
+            if local_file.name in self.uploaded_files:
+                target_name = self.uploaded_files[local_file.name]
+                return f"{self.public_url}/{target_name}"
+        
+        return None
+    
+    def rewrite_match(self, match) -> str:
+        """Return the replacement text for one media link, or the link unchanged"""
+        media_type = match.lastgroup
+        firebase_url = match.group(f"{media_type}_url")
+        firebase_id, extension = extract_firebase_id(firebase_url)
+        
+        if not firebase_id:
+            return match.group(0)
+        
+        replacement_url = self.resolve_media_url(firebase_id, extension)
+        if not replacement_url:
+            self.links_not_found += 1
+            return match.group(0)
+        
+        self.links_updated += 1
+        
+        # Build replacement text
+        if media_type == 'image':
+            alt_text = match.group('alt')
+            return f"![{alt_text}]({replacement_url})"
+        elif media_type == 'pdf':
+            return f"{{{{[[pdf]]: {replacement_url}}}}}"
+        elif media_type == 'video':
+            return f"{{{{[[video]]: {replacement_url}}}}}"
+        else:
+            return f"<{replacement_url}>"
+    
+    def rewrite_page(self, page: Dict) -> Tuple[bytes, bool, int, int]:
+        """
+        Rewrite every block of a page.
+        Returns the encoded page, whether it changed, and its updated/unresolved link counts.
+        """
+        modified = False
+        self.links_updated = 0
+        self.links_not_found = 0
+        
+        # Walk the block tree with an explicit stack, so deeply nested
+        # outlines can't hit the recursion limit
+        stack = list(page.get('children', ()))
+        while stack:
+            block = stack.pop()
+            
+            # Most blocks have no media at all; a plain substring check skips
+            # the regex for them (Firebase storage URLs are always lowercase)
+            original = block.get('string')
+            if original and 'firebasestorage' in original:
+                # Rewrite every media link in a single pass over the string
+                updated = MEDIA_LINK_PATTERN.sub(self.rewrite_match, original)
+                if updated != original:
+                    block['string'] = updated
+                    modified = True
+            
+            if 'children' in block:
+                stack.extend(block['children'])
+        
+        return encode_page(page), modified, self.links_updated, self.links_not_found
+
+# Per-process rewriter for the JSON worker pool
+_worker_rewriter = None
+
+def _init_rewrite_worker(rewriter: LinkRewriter):
+    global _worker_rewriter
+    _worker_rewriter = rewriter
+
+def _rewrite_pages_in_worker(pages: List[Dict]) -> List[Tuple[bytes, bool, int, int]]:
+    return [_worker_rewriter.rewrite_page(page) for page in pages]
+
 class RoamMediaMigrator:
     """
     Main class for migrating Roam Research encrypted graph media files.
@@ -63,16 +305,50 @@ class RoamMediaMigrator:
         self.base_url = f"https://api.cloudflare.com/client/v4/accounts/{self.account_id}/r2/buckets/{self.bucket_name}/objects"
         self.headers = {'Authorization': f'Bearer {self.api_token}'}
         
+        # Shared HTTP session so uploads reuse kept-alive connections
+        # instead of doing a new TLS handshake per file
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = HTTPAdapter(
+            pool_connections=config['CONCURRENCY'],
+            pool_maxsize=config['CONCURRENCY']
+        )
+        self.session.mount('https://', adapter)
+        
+        # S3 API client (optional, streams from disk with multipart uploads)
+        self.s3 = None
+        if config['S3_ACCESS_KEY_ID']:
+            self.s3 = boto3.client(
+                's3',
+                endpoint_url=f"https://{self.account_id}.r2.cloudflarestorage.com",
+                aws_access_key_id=config['S3_ACCESS_KEY_ID'],
+                aws_secret_access_key=config['S3_SECRET_ACCESS_KEY'],
+                region_name='auto',
+                config=BotoConfig(
+                    max_pool_connections=config['CONCURRENCY'] * config['MULTIPART_CONCURRENCY']
+                )
+            )
+            self.transfer_config = TransferConfig(
+                multipart_threshold=config['MULTIPART_THRESHOLD'],
+                max_concurrency=config['MULTIPART_CONCURRENCY'],
+                use_threads=True
+            )
+        
         # File paths
         self.files_folder = Path(config['FILES_FOLDER'])
         self.roam_json = Path(config['ROAM_JSON'])
         self.output_json = Path(config['OUTPUT_JSON'])
         self.progress_file = Path(config['PROGRESS_FILE'])
+        self.progress_log_file = self.progress_file.with_suffix('.jsonl')
         
         # Initialize state
-        self.mapping = {}
+        self.entries = []  # One record per uploaded file
+        self.mapping = {}  # Lookup key -> index into self.entries
         self.progress = self.load_progress()
+        self.replay_progress_log()
+        self.all_files = None  # Media files in export order, filled by build_file_cache
         self.local_files_cache = {}
+        self.files_by_prefix = {}
         self.stats = {
             'total_files': 0,
             'uploaded': 0,
@@ -94,6 +370,10 @@ class RoamMediaMigrator:
             errors.append("BUCKET_NAME is required")
         if not self.config['PUBLIC_URL']:
             errors.append("PUBLIC_URL is required")
+        if bool(self.config['S3_ACCESS_KEY_ID']) != bool(self.config['S3_SECRET_ACCESS_KEY']):
+            errors.append("S3_ACCESS_KEY_ID and S3_SECRET_ACCESS_KEY must be given together")
+        elif self.config['S3_ACCESS_KEY_ID'] and boto3 is None:
+            errors.append("boto3 is required for S3 API uploads (pip install boto3)")
         
         if not os.path.exists(self.config['FILES_FOLDER']):
             errors.append(f"Files folder not found: {self.config['FILES_FOLDER']}")
@@ -111,45 +391,124 @@ class RoamMediaMigrator:
         if self.progress_file.exists():
             print("📂 Found previous progress, resuming...")
             with open(self.progress_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        return {'uploaded_files': {}, 'mapping': {}}
+                progress = json.load(f)
+            
+            # Older progress files stored full records under 'mapping';
+            # those uploads are still known through 'uploaded_files'
+            if 'entries' in progress:
+                self.entries = progress['entries']
+                self.mapping = progress['mapping']
+            return progress
+        return {'uploaded_files': {}, 'entries': [], 'mapping': {}}
+    
+    def replay_progress_log(self):
+        """Apply uploads recorded in the log since the last progress snapshot"""
+        if not self.progress_log_file.exists():
+            return
+        
+        print("📂 Found upload log from an interrupted run, resuming...")
+        valid_lines = []
+        torn = False
+        with open(self.progress_log_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    torn = True  # Line cut short by the interruption
+                    continue
+                torn = torn or not line.endswith('\n')
+                valid_lines.append(line.rstrip('\n') + '\n')
+                self.record_upload(entry)
+        
+        # Drop the partial line so new entries aren't appended onto it
+        if torn:
+            tmp_file = self.progress_log_file.with_name(self.progress_log_file.name + '.tmp')
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                f.writelines(valid_lines)
+            os.replace(tmp_file, self.progress_log_file)
+    
+    def record_upload(self, entry: Dict):
+        """Remember a finished upload for resuming and link rewriting"""
+        stem = Path(entry['original_name']).stem
+        
+        # Store one entry, reachable by base ID (without -image suffix)
+        # and by the full stem for edge cases
+        entry_index = len(self.entries)
+        self.entries.append(entry)
+        self.mapping[stem.replace('-image', '')] = entry_index
+        self.mapping[stem] = entry_index
+        
+        # Mark as uploaded
+        self.progress['uploaded_files'][entry['original_name']] = entry['target_name']
     
     def save_progress(self):
-        """Save current progress"""
+        """Save a consolidated snapshot of the progress and clear the upload log"""
+        self.progress['entries'] = self.entries
         self.progress['mapping'] = self.mapping
-        with open(self.progress_file, 'w', encoding='utf-8') as f:
+        
+        # Write to a temporary file first so an interruption can't leave a truncated snapshot
+        tmp_file = self.progress_file.with_name(self.progress_file.name + '.tmp')
+        with open(tmp_file, 'w', encoding='utf-8') as f:
             json.dump(self.progress, f, indent=2)
+        os.replace(tmp_file, self.progress_file)
+        
+        # Everything in the log is part of the snapshot now
+        if self.progress_log_file.exists():
+            self.progress_log_file.unlink()
+    
+    def iter_media_files(self):
+        """Yield directory entries for the exported media files, skipping hidden files"""
+        # scandir reuses the file type from the directory listing, so
+        # checking is_file() doesn't need a stat() call per file
+        with os.scandir(self.files_folder) as entries:
+            for entry in entries:
+                if entry.is_file() and not entry.name.startswith('.'):
+                    yield entry
     
     def build_file_cache(self):
         """Build a comprehensive cache of all local files for efficient lookup"""
         print("🔍 Building file cache...")
+        all_files = []
         cache = {}
+        by_prefix = defaultdict(list)
         
-        for file_path in self.files_folder.iterdir():
-            if file_path.is_file() and not file_path.name.startswith('.'):
-                name = file_path.name
-                stem = file_path.stem
+        for entry in self.iter_media_files():
+            name = entry.name
+            stem, _ = split_filename(name)
+            file_path = Path(entry.path)
+            all_files.append(file_path)
+            
+            # Store multiple keys for flexible lookup
+            cache[name] = file_path
+            cache[stem] = file_path
+            
+            # Index by every dash-delimited prefix of the stem, since Firebase
+            # IDs can contain dashes themselves (lowercased, like the
+            # case-insensitive numeric suffix match)
+            stem_key = stem.lower()
+            for prefix_end, char in enumerate(stem_key):
+                if char == '-':
+                    by_prefix[stem_key[:prefix_end]].append(file_path)
+            by_prefix[stem_key].append(file_path)
+            
+            # Handle files with suffixes like -image, -12345, etc.
+            if '-' in stem:
+                parts = stem.split('-')
+                base_id = parts[0]
                 
-                # Store multiple keys for flexible lookup
-                cache[name] = file_path
-                cache[stem] = file_path
+                # Store base ID for lookup
+                if base_id not in cache:
+                    cache[base_id] = file_path
                 
-                # Handle files with suffixes like -image, -12345, etc.
-                if '-' in stem:
-                    parts = stem.split('-')
-                    base_id = parts[0]
-                    
-                    # Store base ID for lookup
-                    if base_id not in cache:
-                        cache[base_id] = file_path
-                    
-                    # For files ending with -image
-                    if stem.endswith('-image'):
-                        base_without_image = stem[:-6]  # Remove '-image'
-                        if base_without_image not in cache:
-                            cache[base_without_image] = file_path
+                # For files ending with -image
+                if stem.endswith('-image'):
+                    base_without_image = stem[:-6]  # Remove '-image'
+                    if base_without_image not in cache:
+                        cache[base_without_image] = file_path
         
+        self.all_files = all_files
         self.local_files_cache = cache
+        self.files_by_prefix = dict(by_prefix)
         print(f"✅ Cache built with {len(cache)} entries")
     
     def clean_filename(self, filename: str) -> str:
@@ -174,83 +533,52 @@ class RoamMediaMigrator:
         
         return f"{stem}{ext}"
     
-    def find_file_for_firebase_id(self, firebase_id: str, extension: str) -> Optional[Path]:
-        """
-        Find local file that corresponds to a Firebase storage ID.
-        Handles various naming patterns Roam uses during export.
-        """
-        # Direct lookup attempts
-        lookup_keys = [
-            firebase_id,
-            f"{firebase_id}-image",
-            f"{firebase_id}{extension}",
-            f"{firebase_id}-image{extension}",
-        ]
-        
-        for key in lookup_keys:
-            if key in self.local_files_cache:
-                file_path = self.local_files_cache[key]
-                # Verify extension matches
-                if file_path.suffix.lower() == extension.lower():
-                    return file_path
-        
-        # Pattern matching for files with numeric suffixes
-        pattern = re.compile(f"^{re.escape(firebase_id)}-\\d+{re.escape(extension)}$", re.IGNORECASE)
-        for name, path in self.local_files_cache.items():
-            if isinstance(path, Path) and pattern.match(path.name):
-                return path
-        
-        # Pattern matching for files with additional text
-        for name, path in self.local_files_cache.items():
-            if isinstance(path, Path) and name.startswith(firebase_id) and path.suffix.lower() == extension.lower():
-                return path
-        
-        return None
-    
     def upload_file(self, file_path: Path, target_name: str) -> Tuple[bool, str]:
         """Upload a file to R2/S3 storage"""
         try:
-            # Read file content
-            with open(file_path, 'rb') as f:
-                file_content = f.read()
-            
             # Determine content type
             ext = file_path.suffix.lower()
-            content_types = {
-                '.png': 'image/png',
-                '.jpg': 'image/jpeg',
-                '.jpeg': 'image/jpeg',
-                '.gif': 'image/gif',
-                '.webp': 'image/webp',
-                '.svg': 'image/svg+xml',
-                '.pdf': 'application/pdf',
-                '.mp4': 'video/mp4',
-                '.mp3': 'audio/mpeg',
-                '.wav': 'audio/wav',
-                '.doc': 'application/msword',
-                '.docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
-                '.xls': 'application/vnd.ms-excel',
-                '.xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-                '.zip': 'application/zip',
-            }
-            content_type = content_types.get(ext, 'application/octet-stream')
+            # PNG and JPEG make up nearly all Roam uploads, so check them first
+            if ext == '.png':
+                content_type = 'image/png'
+            elif ext in ('.jpg', '.jpeg'):
+                content_type = 'image/jpeg'
+            else:
+                content_type = (CONTENT_TYPES.get(ext)
+                                or mimetypes.guess_type(file_path.name)[0]
+                                or 'application/octet-stream')
+            
+            # Stream through the S3 API when credentials are available
+            if self.s3 is not None:
+                return self.upload_file_s3(file_path, target_name, content_type)
             
             # Prepare upload
+            file_size = file_path.stat().st_size
             upload_url = f"{self.base_url}/{target_name}"
             upload_headers = {
-                **self.headers,
-                'Content-Type': content_type
+                'Content-Type': content_type,
+                'Content-Length': str(file_size)
             }
             
             # Perform upload with retries
             for attempt in range(self.config['MAX_RETRIES']):
                 try:
-                    response = requests.put(
-                        upload_url,
-                        headers=upload_headers,
-                        data=file_content,
-                        timeout=60
-                    )
+                    # Stream the body from disk, reopening so each retry starts at the beginning
+                    # (requests would fall back to chunked encoding for an empty stream)
+                    with open(file_path, 'rb') as f, ExitStack() as stack:
+                        body = f if file_size else b''
+                        if file_size >= self.config['MMAP_THRESHOLD']:
+                            # Send large files straight from a memory map instead of
+                            # copying them through Python in 8 KB reads
+                            mapped = stack.enter_context(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+                            body = stack.enter_context(memoryview(mapped))
+                        
+                        response = self.session.put(
+                            upload_url,
+                            headers=upload_headers,
+                            data=body,
+                            timeout=(10, 120)  # (connect, read)
+                        )
                     
                     if response.status_code in [200, 201]:
                         public_url = f"{self.public_url}/{target_name}"
@@ -272,13 +600,40 @@ class RoamMediaMigrator:
         
         return False, "Unknown error"
     
+    def upload_file_s3(self, file_path: Path, target_name: str, content_type: str) -> Tuple[bool, str]:
+        """Upload a file through the R2 S3 API, using multipart uploads for large files"""
+        for attempt in range(self.config['MAX_RETRIES']):
+            try:
+                self.s3.upload_file(
+                    str(file_path),
+                    self.bucket_name,
+                    target_name,
+                    ExtraArgs={'ContentType': content_type},
+                    Config=self.transfer_config
+                )
+                return True, f"{self.public_url}/{target_name}"
+            
+            except (S3UploadFailedError, BotoCoreError, ClientError) as e:
+                if attempt < self.config['MAX_RETRIES'] - 1:
+                    time.sleep(2 ** attempt)  # Exponential backoff
+                    continue
+                return False, str(e)
+        
+        return False, "Unknown error"
+    
+    def _upload_one(self, file_path: Path, target_name: str) -> Tuple[str, str, bool, str]:
+        """Upload a single file; safe to run from worker threads"""
+        success, result = self.upload_file(file_path, target_name)
+        return file_path.name, target_name, success, result
+    
     def process_files(self):
         """Process and upload all files from the export folder"""
         print("\n📤 Starting file upload process...")
         
-        # Get all files
-        all_files = [f for f in self.files_folder.iterdir() 
-                     if f.is_file() and not f.name.startswith('.')]
+        # Reuse the folder listing from the file cache
+        if self.all_files is None:
+            self.build_file_cache()
+        all_files = self.all_files
         
         self.stats['total_files'] = len(all_files)
         
@@ -289,8 +644,8 @@ class RoamMediaMigrator:
         print(f"📊 Found {self.stats['total_files']} files to process")
         print("="*60)
         
-        start_time = time.time()
-        
+        # Decide what needs uploading and under which name
+        work = []
         for idx, file_path in enumerate(all_files, 1):
             original_name = file_path.name
             
@@ -310,155 +665,163 @@ class RoamMediaMigrator:
                     print(f"  → Cleaned: {target_name[:40]}")
                 else:
                     target_name = original_name
-                    print(f"[{idx}/{self.stats['total_files']}] 📤 {original_name[:50]}")
             else:
                 # Generate hash-based name for privacy
-                name_hash = hashlib.md5(original_name.encode()).hexdigest()[:12]
+                name_hash = short_hash(original_name.encode())
                 target_name = f"{name_hash}{file_path.suffix}"
                 print(f"[{idx}/{self.stats['total_files']}] 🔐 {original_name[:40]} → {target_name}")
             
-            # Upload file
-            success, result = self.upload_file(file_path, target_name)
+            work.append((file_path, target_name))
+        
+        if not work:
+            print("✅ All files already uploaded")
+            self.save_progress()
+            return
+        
+        print(f"📤 Uploading {len(work)} files ({self.config['CONCURRENCY']} at a time)")
+        
+        start_time = time.time()
+        batch_time = datetime.now().isoformat()  # Upload timestamp, refreshed every batch
+        completed = 0
+        
+        # Each finished upload is appended to the log right away, so an
+        # interrupted run can resume without rewriting the whole snapshot
+        with open(self.progress_log_file, 'a', encoding='utf-8', buffering=1) as progress_log, \
+                ThreadPoolExecutor(max_workers=self.config['CONCURRENCY']) as executor:
+            futures = [
+                executor.submit(self._upload_one, file_path, target_name)
+                for file_path, target_name in work
+            ]
             
-            if success:
-                self.stats['uploaded'] += 1
-                
-                # Store mapping - use base ID without -image suffix
-                base_id = file_path.stem.replace('-image', '')
-                self.mapping[base_id] = {
-                    'original_name': original_name,
-                    'target_name': target_name,
-                    'public_url': result,
-                    'uploaded_at': datetime.now().isoformat()
-                }
-                
-                # Also store with full stem for edge cases
-                self.mapping[file_path.stem] = self.mapping[base_id]
-                
-                # Mark as uploaded
-                self.progress['uploaded_files'][original_name] = target_name
-                
-                print(f"  ✅ Success! Available at: {result}")
-            else:
-                self.stats['failed'] += 1
-                print(f"  ❌ Failed: {result}")
+            try:
+                # Results are recorded here, on the main thread, so the
+                # shared state needs no locking
+                for future in as_completed(futures):
+                    original_name, target_name, success, result = future.result()
+                    completed += 1
+                    
+                    if success:
+                        self.stats['uploaded'] += 1
+                        
+                        entry = {
+                            'original_name': original_name,
+                            'target_name': target_name,
+                            'public_url': result,
+                            'uploaded_at': batch_time
+                        }
+                        self.record_upload(entry)
+                        progress_log.write(json.dumps(entry, ensure_ascii=False) + '\n')
+                        
+                        print(f"[{completed}/{len(work)}] ✅ {original_name[:50]} → {result}")
+                    else:
+                        self.stats['failed'] += 1
+                        print(f"[{completed}/{len(work)}] ❌ {original_name[:50]}: {result}")
+                    
+                    # Report progress periodically
+                    if completed % self.config['BATCH_SIZE'] == 0:
+                        batch_time = datetime.now().isoformat()
+                        elapsed = time.time() - start_time
+                        rate = completed / elapsed if elapsed > 0 else 1
+                        remaining = (len(work) - completed) / rate if rate > 0 else 0
+                        print(f"\n⏱️  Progress: {completed}/{len(work)} - ETA: {int(remaining/60)} minutes\n")
             
-            # Save progress periodically
-            if idx % self.config['BATCH_SIZE'] == 0:
-                self.save_progress()
-                elapsed = time.time() - start_time
-                rate = idx / elapsed if elapsed > 0 else 1
-                remaining = (self.stats['total_files'] - idx) / rate if rate > 0 else 0
-                print(f"\n⏱️  Progress: {idx}/{self.stats['total_files']} - ETA: {int(remaining/60)} minutes")
-                print(f"💾 Progress saved\n")
-        
-        # Final save
+            except KeyboardInterrupt:
+                # Drop queued uploads; finished ones are already in the log
+                for future in futures:
+                    future.cancel()
+                raise
+        
+        # Consolidate the log into the progress snapshot
         self.save_progress()
         
         total_time = time.time() - start_time
         print(f"\n✅ Upload complete in {int(total_time/60)} minutes")
     
+    def iter_pages(self):
+        """Yield the pages of the Roam JSON export one at a time"""
+        with open(self.roam_json, 'rb') as f:
+            pages_read = 0
+            if ijson is not None:
+                # Streams the file so only one page is in memory at a time
+                try:
+                    for page in ijson.items(f, 'item', use_float=True):
+                        yield page
+                        pages_read += 1
+                    return
+                except ijson.JSONError:
+                    # e.g. integers wider than 64 bits, which the C backend rejects;
+                    # json.load handles them, so re-read and continue after the
+                    # pages already yielded
+                    f.seek(0)
+            
+            yield from itertools.islice(json.load(f), pages_read, None)
+    
+    def rewrite_pages(self, pages):
+        """Rewrite pages in order, in parallel worker processes when configured"""
+        rewriter = LinkRewriter(
+            self.public_url,
+            self.entries,
+            self.mapping,
+            self.progress['uploaded_files'],
+            self.local_files_cache,
+            self.files_by_prefix
+        )
+        
+        workers = self.config['JSON_WORKERS']
+        if workers <= 1:
+            for page in pages:
+                yield rewriter.rewrite_page(page)
+            return
+        
+        # Hand pages to the pool in bounded batches so streamed input
+        # isn't read into memory all at once
+        chunk_size = self.config['JSON_CHUNK_SIZE']
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_rewrite_worker,
+                                 initargs=(rewriter,)) as executor:
+            while True:
+                batch = list(itertools.islice(pages, workers * chunk_size * 4))
+                if not batch:
+                    break
+                
+                chunks = [batch[i:i + chunk_size] for i in range(0, len(batch), chunk_size)]
+                futures = [executor.submit(_rewrite_pages_in_worker, chunk) for chunk in chunks]
+                for chunk, future in zip(chunks, futures):
+                    try:
+                        yield from future.result()
+                    except (RecursionError, pickle.PicklingError):
+                        # Pages nested too deeply to pickle are rewritten here instead
+                        for page in chunk:
+                            yield rewriter.rewrite_page(page)
+    
     def update_roam_json(self):
         """Update all Firebase storage links in the Roam JSON export"""
         print("\n📝 Updating Roam JSON file...")
         
-        # Load JSON
-        with open(self.roam_json, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
-        print(f"✅ Loaded {len(data)} pages")
-        
-        def extract_firebase_id(url: str) -> Tuple[Optional[str], Optional[str]]:
-            """Extract file ID and extension from Firebase URL"""
-            match = re.search(r'imgs%2Fapp%2F[^%]+%2F([^.]+)\.([^.]+)\.enc', url)
-            if match:
-                return match.group(1), '.' + match.group(2)
-            return None, None
-        
-        def process_block(block: Dict) -> bool:
-            """Process a single block and its children recursively"""
-            modified = False
-            
-            if 'string' in block:
-                original = block['string']
+        # Process pages one at a time, writing each as soon as it is done.
+        # The output matches json.dump(data, indent=2) on the whole list.
+        pages_modified = 0
+        page_count = 0
+        tmp_output = self.output_json.with_name(self.output_json.name + '.tmp')
+        with open(tmp_output, 'wb') as out:
+            out.write(b'[')
+            for idx, result in enumerate(self.rewrite_pages(self.iter_pages())):
+                if idx % 100 == 0 and idx > 0:
+                    print(f"  Processing page {idx}...")
                 
-                # Patterns for different media types
-                patterns = [
-                    (r'!\[([^\]]*)\]\((https://firebasestorage[^)]+\.enc[^)]*)\)', 'image'),
-                    (r'\{\{\[\[pdf\]\]:\s*(https://firebasestorage[^}]+\.enc[^}]*)\}\}', 'pdf'),
-                    (r'\{\{\[\[video\]\]:\s*(https://firebasestorage[^}]+\.enc[^}]*)\}\}', 'video'),
-                    (r'<(https://firebasestorage[^>]+\.enc[^>]*)>', 'link'),
-                ]
+                page_json, page_modified, links_updated, links_not_found = result
+                if page_modified:
+                    pages_modified += 1
+                self.stats['links_updated'] += links_updated
+                self.stats['links_not_found'] += links_not_found
                 
-                for pattern, media_type in patterns:
-                    for match in re.finditer(pattern, original, re.IGNORECASE):
-                        firebase_url = match.group(2) if media_type == 'image' else match.group(1)
-                        firebase_id, extension = extract_firebase_id(firebase_url)
-                        
-                        if not firebase_id:
-                            continue
-                        
-                        # Find replacement URL
-                        replacement_url = None
-                        
-                        # First check direct mapping
-                        if firebase_id in self.mapping:
-                            replacement_url = self.mapping[firebase_id]['public_url']
-                        else:
-                            # Try to find the file
-                            local_file = self.find_file_for_firebase_id(firebase_id, extension)
-                            if local_file:
-                                # Check if it was uploaded with a different name
-                                if local_file.name in self.progress['uploaded_files']:
-                                    target_name = self.progress['uploaded_files'][local_file.name]
-                                    replacement_url = f"{self.public_url}/{target_name}"
-                        
-                        if replacement_url:
-                            # Build replacement text
-                            if media_type == 'image':
-                                alt_text = match.group(1)
-                                new_text = f"![{alt_text}]({replacement_url})"
-                            elif media_type == 'pdf':
-                                new_text = f"{{{{[[pdf]]: {replacement_url}}}}}"
-                            elif media_type == 'video':
-                                new_text = f"{{{{[[video]]: {replacement_url}}}}}"
-                            else:
-                                new_text = f"<{replacement_url}>"
-                            
-                            block['string'] = block['string'].replace(match.group(0), new_text)
-                            self.stats['links_updated'] += 1
-                            modified = True
-                        else:
-                            self.stats['links_not_found'] += 1
-            
-            # Process children recursively
-            if 'children' in block:
-                for child in block['children']:
-                    if process_block(child):
-                        modified = True
-            
-            return modified
-        
-        # Process all pages
-        pages_modified = 0
-        for idx, page in enumerate(data):
-            if idx % 100 == 0 and idx > 0:
-                print(f"  Processing page {idx}/{len(data)}...")
-            
-            page_modified = False
-            if 'children' in page:
-                for child in page['children']:
-                    if process_block(child):
-                        page_modified = True
-            
-            if page_modified:
-                pages_modified += 1
+                out.write(b',\n  ' if idx else b'\n  ')
+                out.write(page_json.replace(b'\n', b'\n  '))
+                page_count += 1
+            out.write(b'\n]' if page_count else b']')
         
-        # Save updated JSON
-        print(f"💾 Saving updated JSON...")
-        with open(self.output_json, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_output, self.output_json)
         
+        print(f"✅ Processed {page_count} pages")
         print(f"✅ Updated {self.stats['links_updated']} links in {pages_modified} pages")
         if self.stats['links_not_found'] > 0:
             print(f"⚠️  {self.stats['links_not_found']} links could not be resolved")
@@ -470,7 +833,7 @@ class RoamMediaMigrator:
         print("🔌 Testing API connection...")
         try:
             test_url = f"https://api.cloudflare.com/client/v4/accounts/{self.account_id}/r2/buckets"
-            response = requests.get(test_url, headers=self.headers, timeout=10)
+            response = self.session.get(test_url, timeout=10)
             
             if response.status_code == 200:
                 print("✅ Connection successful!")
@@ -558,7 +921,11 @@ For more information, visit: https://github.com/rodrigo-kiko/roam-encrypted-migr
     parser.add_argument('--progress', help='Progress file path (default: same directory as JSON)')
     parser.add_argument('--no-clean', action='store_true', help='Do not clean filenames (keep spaces and special chars)')
     parser.add_argument('--use-hash', action='store_true', help='Use hash-based filenames for privacy')
-    parser.add_argument('--batch-size', type=int, default=50, help='Files to process before saving progress (default: 50)')
+    parser.add_argument('--batch-size', type=int, default=50, help='Files to process between progress reports (default: 50)')
+    parser.add_argument('--s3-key-id', help='R2 S3 API access key ID (enables multipart uploads, requires boto3)')
+    parser.add_argument('--s3-secret', help='R2 S3 API secret access key')
+    parser.add_argument('--concurrency', type=int, default=16, help='Number of parallel uploads (default: 16)')
+    parser.add_argument('--json-workers', type=int, default=os.cpu_count() or 1, help='Processes used to update the JSON (default: number of CPUs)')
     
     return parser.parse_args()
 
@@ -573,6 +940,8 @@ def main():
     config['BUCKET_NAME'] = args.bucket
     config['PUBLIC_URL'] = args.url
     config['FILES_FOLDER'] = args.files
+    config['S3_ACCESS_KEY_ID'] = args.s3_key_id or ''
+    config['S3_SECRET_ACCESS_KEY'] = args.s3_secret or ''
     config['ROAM_JSON'] = args.json
     
     # Set output path
@@ -593,6 +962,8 @@ def main():
     config['CLEAN_FILENAMES'] = not args.no_clean
     config['KEEP_ORIGINAL_NAMES'] = not args.use_hash
     config['BATCH_SIZE'] = args.batch_size
+    config['CONCURRENCY'] = max(1, args.concurrency)
+    config['JSON_WORKERS'] = max(1, args.json_workers)
     
     # Run migration
     try: